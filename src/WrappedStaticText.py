@@ -22,21 +22,209 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
 
+from bisect import bisect_right
+from functools import lru_cache
+import weakref
+
+import wx
+
+################################################################################
+############################### Text Measurement ###############################
+
+## DC shared by every text measurement, and the font key it is set up with
+_dc = None
+_dc_font_key = None
+
+def _release_dc():
+    """
+    Releases the measuring DC and clears the measurement caches. Called when
+    the wx.App the DC was created with goes away, as wx objects must not
+    outlive it.
+    """
+    global _dc, _dc_font_key
+    _dc = None
+    _dc_font_key = None
+    for cached in (_measure, _partial_extents, _line_height, _compute_wrap):
+        cached.cache_clear()
+
+def _measure_dc(font_key):
+    """
+    Gives the DC shared by every text measurement, set up with a font. The DC
+    is created once per wx.App, and its font only set when it changes, as it
+    is slow.
+    
+    * `font_key`: native font info description of the font to set up (see
+      `wx.Font.GetNativeFontInfoDesc`)
+    
+    * returns: the measuring DC
+    """
+    global _dc, _dc_font_key
+    if _dc is None:
+        _dc = wx.MemoryDC(wx.Bitmap(1, 1))
+        ## Released when the app is deleted, or at exit if it is still alive
+        weakref.finalize(wx.GetApp(), _release_dc)
+    if font_key != _dc_font_key:
+        _dc.SetFont(wx.Font(font_key))
+        _dc_font_key = font_key
+    return _dc
+
+@lru_cache(maxsize=4096)
+def _measure(font_key, text):
+    """
+    Computes the extent of a text. Text-extent computation is slow, so results
+    are cached for every font and text.
+    
+    * `font_key`: native font info description of the font to measure the
+      text with (see `wx.Font.GetNativeFontInfoDesc`)
+    * `text`: text to measure, may contain several lines
+    
+    * returns: `(width, height)` of the text
+    """
+    w, h = _measure_dc(font_key).GetMultiLineTextExtent(text)
+    return w, h
+
+@lru_cache(maxsize=256)
+def _partial_extents(font_key, text):
+    """
+    Computes the width of every prefix of a single-line text in one call.
+    Results are cached for every font and text.
+    
+    * `font_key`: native font info description of the font to measure the
+      text with (see `wx.Font.GetNativeFontInfoDesc`)
+    * `text`: single-line text to measure
+    
+    * returns: tuple whose i-th item is the width of the first i+1 characters
+      of the text
+    """
+    extents = _measure_dc(font_key).GetPartialTextExtents(text)
+    
+    ## wxString may be UTF-16 (e.g. on MSW), giving one extent per code unit:
+    #  keep the extent of the last code unit of every character
+    if len(extents) != len(text):
+        units = 0
+        char_extents = []
+        for c in text:
+            units += 2 if ord(c) > 0xFFFF else 1
+            char_extents.append(extents[units-1])
+        extents = char_extents
+    return tuple(extents)
+
+@lru_cache(maxsize=64)
+def _line_height(font_key):
+    """
+    Computes the height of a line of text. Results are cached for every font.
+    
+    * `font_key`: native font info description of the font (see
+      `wx.Font.GetNativeFontInfoDesc`)
+    
+    * returns: the height of a line
+    """
+    return _measure_dc(font_key).GetCharHeight()
+
+################################################################################
+################################ Line Breaking #################################
+
+def _break_rows(starts, ends, max_width, max_rows):
+    """
+    Fills every row with as many words as possible, which gives the wrapping
+    with the smallest number of rows. Only works on word positions, so that
+    the wrapped label is built once from the result.
+    
+    * `starts`: horizontal position where every word starts in the single-row
+      label
+    * `ends`: horizontal position where every word ends in the single-row
+      label
+    * `max_width`: maximum width of a row
+    * `max_rows`: maximum number of rows, or 0 for no limit. Filling stops as
+      soon as this number is exceeded
+    
+    * returns: list of the indices of the words starting a row (at most
+      `max_rows`+1 of them)
+    """
+    breaks = [0]
+    for i in range(1, len(starts)):
+        if ends[i] - starts[breaks[-1]] > max_width:
+            breaks.append(i)
+            if max_rows and len(breaks) > max_rows:
+                break
+    return breaks
+
+@lru_cache(maxsize=256)
+def _compute_wrap(label_split, width, font_key, max_rows):
+    """
+    Computes the wrapped version of a label. Results are cached, as the same
+    label is wrapped again on every font change and resize.
+    
+    * `label_split`: tuple of the words of the label to wrap
+    * `width`: maximum width of a row
+    * `font_key`: native font info description of the font to measure the
+      label with (see `wx.Font.GetNativeFontInfoDesc`)
+    * `max_rows`: maximum number of rows, or 0 for no limit
+    
+    * returns: the wrapped label, possibly ellipsed
+    """
+    if not label_split:
+        return ""
+    
+    ## Measure the single-row label once, and deduce from it where every
+    #  word starts and ends
+    text = " ".join(label_split)
+    extents = _partial_extents(font_key, text)
+    
+    ## Most labels fit on a single row: nothing to wrap
+    if extents[-1] <= width:
+        return text
+    
+    starts, ends = [], []
+    pos = 0
+    for word in label_split:
+        starts.append(extents[pos-1] if pos else 0)
+        pos += len(word)
+        ends.append(extents[pos-1])
+        pos += 1
+    
+    if any(e - s > width for s, e in zip(starts, ends)):
+        ## A word is too wide for any row: ellipse the single-row label
+        breaks = [0]
+        ellipsed = True
+    else:
+        breaks = _break_rows(starts, ends, width, max_rows)
+    
+        ## Too many rows: the last allowed row gets the remaining words
+        #  and is ellipsed
+        ellipsed = bool(max_rows) and len(breaks) > max_rows
+        if ellipsed:
+            breaks = breaks[:max_rows]
+    
+    lines = [" ".join(label_split[b:e])
+             for b, e in zip(breaks, breaks[1:]+[None])]
+    
+    ## In case of wrapping fail, keep the longest beginning of the last row
+    #  that fits along with an ellipsis. The last row ends the single-row
+    #  label, so its widths are read from the extents measured above
+    if ellipsed:
+        last_line = lines[-1]
+        offset = len(text) - len(last_line)
+        max_end = starts[breaks[-1]] + width - _measure(font_key, "…")[0]
+        length = bisect_right(extents, max_end, lo=offset) - offset
+        lines[-1] = last_line[:length].rstrip()+"…"
+    return "\n".join(lines)
+
 ################################################################################
 ############################## Wrapped Static Text #############################
 
 class WrappedStaticText(wx.StaticText):
     """
-    A StaticText with advanced wrapping management. Every possible wrapping
-    of the label is computed (can be CPU-consuming if label has many spaces)
-    and the best one is selected, i.e. the one that respects the wrapping rule
-    and uses the smallest number of rows. If no wrapping is possible, an
-    ellipsed label is used, based on the least wide and high combination.
+    A StaticText with advanced wrapping management. Each row of the label is
+    filled with as many words as possible, which gives the wrapping that
+    respects the wrapping rule and uses the smallest number of rows. If no
+    wrapping is possible (a word is wider than a row, or there are more rows
+    than allowed), the last row is ellipsed.
     """
     def __init__(self, parent, line_spacing_factor=0,
                  non_breaking_spaces = True, justify_last_line = False,
-                 max_space_width_factor= 1.6, *args, **kwargs):
-              """
+                 max_space_width_factor= 1.6, *args, max_rows=0, **kwargs):
+        """
         Constructor.
 
         Parameters:
@@ -49,6 +237,8 @@ class WrappedStaticText(wx.StaticText):
             Default is False.
         * `max_space_width_factor` (float): Maximum width factor for spaces when justifying.
             Default is 1.6.
+        * `max_rows` (int): Maximum number of rows, the last one being ellipsed
+            if the label does not fit. Default is 0 (no limit).
         * `*args`: Additional positional arguments passed to wx.StaticText constructor.
         * `**kwargs`: Additional keyword arguments passed to wx.StaticText constructor.
 
@@ -57,22 +247,14 @@ class WrappedStaticText(wx.StaticText):
         `wx.ST_NO_AUTORESIZE` added to it. If `style` is not provided, it will
         be set to `wx.ST_NO_AUTORESIZE`.
         """
-                     
+        
         self._nonBreakingSpaces = non_breaking_spaces
         
         # First thing todo is to extract `style` from arguments in order to add
-        # wx.ST_NO_AUTORESIZE to it
-        
-        # Find the position of 'style' in the parent's __init__ method
-        parent_params = wx.StaticText.__init__.__code__.co_varnames
-        style_index = parent_params.index('style') if 'style' in parent_params else -1
-
-        # Update style in args or kwargs with wx.ST_NO_AUTORESIZE
-        if "style" in wx.StaticText.__init__.__code__.co_varnames:
-            args_list = list(args)
-            style_index = wx.StaticText.__init__.__code__.co_varnames.index("style")
-            args_list[style_index] = args_list[style_index] | wx.ST_NO_AUTORESIZE
-            args = tuple(args_list)
+        # wx.ST_NO_AUTORESIZE to it. wx.StaticText's positional parameters
+        # after `parent` are `id`, `label`, `pos`, `size` then `style`
+        if len(args) > 4:
+            args = args[:4] + (args[4] | wx.ST_NO_AUTORESIZE,) + args[5:]
         else:
             kwargs["style"] = kwargs.get("style", 0) | wx.ST_NO_AUTORESIZE
 
@@ -81,7 +263,22 @@ class WrappedStaticText(wx.StaticText):
         self.line_spacing_factor = line_spacing_factor
         self.justify_last_line = justify_last_line
         self.max_space_width_factor = max_space_width_factor
+        self.maxRows = max_rows
+        self._fontKey = self.GetFont().GetNativeFontInfoDesc()
+        self._unwrappedLabel = None
+        self._lastWidth = None
+        self._resizeTimer = None
         self.Bind(wx.EVT_PAINT, self._OnPaint)
+        self.Bind(wx.EVT_SIZE, self._OnResize)
+        self.SetLabel(self.GetLabel())
+        self._lastWidth = self.wrappedWidth
+
+    @property
+    def wrappedWidth(self):
+        """
+        Maximum width of a row, i.e. the width of the text's client area.
+        """
+        return self.GetClientSize().width
 
     def SetLabel(self, label):
         """
@@ -89,50 +286,13 @@ class WrappedStaticText(wx.StaticText):
         
         * `label`: new label to wrap and display
         """
-        self._unwrappedLabel = label
-        dc = wx.ScreenDC()
-        dc.SetFont(self.GetFont())
-        
-        label_split = label.split()
-        
-        ## For wrapping label
-        best_height = sys.maxsize
-        best_height = sys.maxsize
-        best_label = None
-        
-        ## For ellipsis if wrapping is not possible because of too long word
-        best_unwrapped_height = sys.maxsize
-        best_unwrapped_width = sys.maxsize
-        best_unwrapped_label = None
-        labels = self._GetWrappings(label_split[0], label_split[1:])
-        
-        ## Search for the best label
-        for l in labels:
-            w,h = dc.GetMultiLineTextExtent(l)
-            
-            ## Update best wrapping
-            if w <= self.wrappedWidth:
-                if h < best_height:
-                    best_label  = l
-                    best_height = h
-            ## Update best ellipsis in case of wrapping fail
-            elif h == best_unwrapped_height:
-                 if w < best_unwrapped_width:
-                        best_unwrapped_label  = l
-                        best_unwrapped_width = w
-            elif h < best_unwrapped_height:
-                        best_unwrapped_label  = l
-                        best_unwrapped_widtht = w
-                        best_unwrapped_height = h
-        
-        ## In case of wrapping fail, search for the best ellipsed label
-        if best_label == None:
-            while best_unwrapped_width > self.wrappedWidth:
-                best_unwrapped_label = best_unwrapped_label[:-1]
-                best_unwrapped_width = \
-                    dc.GetMultiLineTextExtent(best_unwrapped_label+"…")[0]
-            best_label = best_unwrapped_label+"…"
-        super().SetLabel(best_label)
+        ## Only split the label into words when it changes, not on every font
+        #  change or resize
+        if label != self._unwrappedLabel:
+            self._unwrappedLabel = label
+            self._labelSplit = tuple(label.split())
+        super().SetLabel(_compute_wrap(self._labelSplit, self.wrappedWidth,
+                                       self._fontKey, self.maxRows))
 
     def SetFont(self, font):
         """
@@ -141,35 +301,58 @@ class WrappedStaticText(wx.StaticText):
         * `font`: new font to wrap and display the text's label with
         """
         super().SetFont(font)
+        ## Read the resulting font, as e.g. wx.NullFont resets the default one
+        self._fontKey = self.GetFont().GetNativeFontInfoDesc()
         self.SetLabel(self._unwrappedLabel)
 
-    def _GetWrappings(self, text, words):
+    def _OnPaint(self, event):
         """
-        Recursively compute all combinations of text splitting using either a
-        space or a new line. May be time-consuming if label has too many spaces.
-        
-        * `text`: beginning of the full label, already wrapped
-        * `words`: list of remaining words to be added to `text`
+        Paint callback. Overrides the paint event callback so that centered text
+        painting renders the right way with wrapped text.
+        """
+        dc = wx.PaintDC(self)
+        dc.SetFont(self.GetFont())
+        dc.SetTextForeground(self.GetForegroundColour())
+        style = self.GetWindowStyle()
+        line_h = _line_height(self._fontKey) + round(
+            self.line_spacing_factor * self.GetFont().GetPointSize())
         
-        * yields: every combinations of `text` and remaining words, concatenated
-          either with `'\n'` ot `' '`
+        label_h = 0
+        for line in self.GetLabel().split("\n"):
+            line_w = _measure(self._fontKey, line)[0]
+            if style & wx.ALIGN_CENTER_HORIZONTAL:
+                x = (self.wrappedWidth - line_w) // 2
+            elif style & wx.ALIGN_RIGHT:
+                x = self.wrappedWidth - line_w
+            else:
+                x = 0
+            dc.DrawText(line, x, label_h)
+            label_h += line_h
+
+    def _OnResize(self, event):
+        """
+        Resize callback. Wraps the label again when the text's width changes.
         """
-        if len(words) == 0:
-            # if there is no space at all in the unwrapped label
-            yield text
-        elif len(words) == 1:
-            ## if it's the last word of the text, just yield the two versions
-            yield text+" "  + words[0]
-            yield text+"\n" + words[0]
+        event.Skip()
+        width = self.wrappedWidth
+        if width == self._lastWidth:
+            return
+        self._lastWidth = width
+        
+        ## Size events come in bursts while a window is being resized: wrap
+        #  the label again only once they stop for 50 ms
+        if self._resizeTimer is not None and self._resizeTimer.IsRunning():
+            self._resizeTimer.Restart(50)
         else:
-            ## try the two spliting combinations, and recursively compute the
-            #  wrapping for the remaining text
-            yield from self._GetWrappings(text+" "  + words[0], words[1:])
-            yield from self._GetWrappings(text+"\n" + words[0], words[1:])
-    
-    def _OnResize(self, event):
+            self._resizeTimer = wx.CallLater(50, self._OnResizeEnd)
+
+    def _OnResizeEnd(self):
         """
-        Paint callback. Overrides the paint event callback so that centered text
-        painting renders the right way with wrapped text.
+        Wraps the label again once resizing is over.
         """
-        self.SetLabel(self._unwrappedLabel)
+        ## The control may have been destroyed in the meantime
+        if self:
+            ## wx may have changed the font without calling SetFont (e.g.
+            #  SetOwnFont, or a DPI change rescaling it)
+            self._fontKey = self.GetFont().GetNativeFontInfoDesc()
+            self.SetLabel(self._unwrappedLabel)